@@ -7,40 +7,258 @@ Usage:
     python gtfs_to_png.py --shapes shapes.txt --out overlay.png
 """
 import argparse
+import csv
+import dataclasses
+import functools
 import json
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import shapely
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_hex, to_rgba
+from PIL import Image
 from pathlib import Path
-from shapely.geometry import LineString, Point
+
+try:
+    import imagecodecs
+except ImportError:  # optional: PNG encoding falls back to Pillow
+    imagecodecs = None
+try:
+    import numba
+except ImportError:  # optional: per-shape bounds fall back to numpy
+    numba = None
+
+# Columns read from each GTFS file; anything else is skipped at parse time
+SHAPES_TYPES = {
+    # dictionary-encoded: each batch stores shape_id strings once
+    "shape_id": pa.dictionary(pa.int32(), pa.string()),
+    # float32 is ~1 m precision in degrees, plenty for a raster overlay
+    "shape_pt_lat": pa.float32(),
+    "shape_pt_lon": pa.float32(),
+    "shape_pt_sequence": pa.int32(),
+}
+# shapes.txt is parsed in blocks of this many bytes
+SHAPES_BLOCK_SIZE = 64 << 20
+TRIPS_DTYPES = {
+    "trip_id": "string",
+    # categorical ids make route/shape isin filters compare integer codes
+    "route_id": "category",
+    "shape_id": "category",
+    "direction_id": "Int8",
+}
+ROUTES_DTYPES = {"route_id": "string", "route_color": "string"}
+STOPS_DTYPES = {"stop_id": "string", "stop_lat": "float64", "stop_lon": "float64"}
+# Per-shape envelope columns precomputed by read_shapes
+BOUNDS_COLUMNS = ["min_lon", "min_lat", "max_lon", "max_lat"]
+
+
+@dataclasses.dataclass
+class ShapesRagged:
+    """
+    GTFS shapes as flat arrays: shape i is coords[offsets[i]:offsets[i + 1]].
+    bounds holds one BOUNDS_COLUMNS row per shape, colors an optional
+    route_color per shape (missing values allowed).
+    """
+
+    shape_ids: pd.Categorical
+    offsets: np.ndarray
+    coords: np.ndarray
+    bounds: np.ndarray
+    colors: np.ndarray = None
+
+    def __len__(self):
+        return len(self.shape_ids)
+
+    @functools.cached_property
+    def segments(self):
+        # per-shape (n, 2) views into coords, built once per instance so
+        # repeated renders (other linewidth/color) reuse them
+        return np.split(self.coords, self.offsets[1:-1])
+
+    def take(self, mask):
+        # keep the shapes selected by a boolean mask, rebuilding offsets
+        counts = np.diff(self.offsets)
+        return ShapesRagged(
+            shape_ids=self.shape_ids[mask],
+            offsets=np.concatenate(([0], np.cumsum(counts[mask]))),
+            coords=self.coords[np.repeat(mask, counts)],
+            bounds=self.bounds[mask],
+            colors=None if self.colors is None else self.colors[mask],
+        )
+
+    def to_geodataframe(self):
+        # build Shapely geometries only when explicitly asked for
+        import geopandas as gpd
+
+        counts = np.diff(self.offsets)
+        # GEOS works in float64
+        geoms = shapely.linestrings(
+            self.coords.astype(np.float64),
+            indices=np.repeat(np.arange(len(self)), counts),
+        )
+        gdf = gpd.GeoDataFrame(
+            {"shape_id": self.shape_ids}, geometry=geoms, crs="EPSG:4326"
+        )
+        gdf[BOUNDS_COLUMNS] = self.bounds.astype(np.float64)
+        if self.colors is not None:
+            gdf["color"] = self.colors
+        return gdf
+
+
+def _per_shape_bounds_kernel(coords, offsets, out):
+    # comparisons with NaN are false, so blank coordinates are skipped like
+    # np.fmin/np.fmax in the numpy fallback
+    for i in numba.prange(len(offsets) - 1):
+        s, e = offsets[i], offsets[i + 1]
+        mn0 = mn1 = np.inf
+        mx0 = mx1 = -np.inf
+        for k in range(s, e):
+            x = coords[k, 0]
+            y = coords[k, 1]
+            if x < mn0:
+                mn0 = x
+            if x > mx0:
+                mx0 = x
+            if y < mn1:
+                mn1 = y
+            if y > mx1:
+                mx1 = y
+        # an axis with no valid value stays NaN, as fmin/fmax give
+        if mn0 > mx0:
+            mn0 = mx0 = np.nan
+        if mn1 > mx1:
+            mn1 = mx1 = np.nan
+        out[i, 0] = mn0
+        out[i, 1] = mn1
+        out[i, 2] = mx0
+        out[i, 3] = mx1
+
+
+@functools.cache
+def _compiled_bounds_kernel(coords_dtype, offsets_dtype):
+    # one eager compile per dtype pair, reused for the rest of the process
+    # (and across runs through numba's on-disk cache)
+    coords_t = numba.from_dtype(coords_dtype)
+    offsets_t = numba.from_dtype(offsets_dtype)
+    signature = (coords_t[:, :], offsets_t[:], coords_t[:, :])
+    return numba.njit(signature, parallel=True, cache=True)(_per_shape_bounds_kernel)
+
+
+def per_shape_bounds(coords, offsets):
+    """
+    Envelope (min_lon, min_lat, max_lon, max_lat) of each shape of a ragged
+    coords/offsets pair, in one pass over the points.
+    """
+    out = np.empty((len(offsets) - 1, 4), dtype=coords.dtype)
+    if numba is not None:
+        kernel = _compiled_bounds_kernel(coords.dtype, offsets.dtype)
+        kernel(coords, offsets, out)
+    elif len(out):
+        # fmin/fmax skip NaN (blank lat/lon cells) like the numba kernel
+        out[:, :2] = np.fmin.reduceat(coords, offsets[:-1], axis=0)
+        out[:, 2:] = np.fmax.reduceat(coords, offsets[:-1], axis=0)
+    return out
 
 
-def read_shapes(shapes_path):
+def read_gtfs_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+
+def read_gtfs_csv(path, dtypes):
+    """
+    Read the columns of a GTFS file listed in dtypes with the pyarrow parser.
+    Columns absent from the file are left out rather than raising.
+    """
+    header = read_gtfs_header(path)
+    usecols = [c for c in header if c in dtypes]
+    # string and categorical columns are typed in the Arrow parser itself:
+    # casting after inference would turn ids like "007" into "7" and give
+    # numeric ids int categories that never match string route/shape ids
+    column_types = {
+        c: pa.string() for c in usecols if dtypes[c] in ("string", "category")
+    }
+    table = pacsv.read_csv(
+        path,
+        convert_options=pacsv.ConvertOptions(
+            include_columns=usecols,
+            column_types=column_types,
+            # blank cells stay NA, not ""
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas().astype({c: dtypes[c] for c in usecols})
+
+
+def read_shapes(shapes_path, allowed_shape_ids=None):
     # GTFS shapes.txt has: shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence (and optional dist_traveled)
-    df = pd.read_csv(shapes_path, dtype={"shape_id": str})
-    required = {"shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"}
-    if not required.issubset(set(df.columns)):
-        raise SystemExit(f"shapes.txt missing columns: {required - set(df.columns)}")
-    df = df.sort_values(["shape_id", "shape_pt_sequence"])
-    lines = []
-    for sid, group in df.groupby("shape_id"):
-        coords = list(
-            zip(
-                group["shape_pt_lon"].astype(float), group["shape_pt_lat"].astype(float)
-            )
+    # allowed_shape_ids: optional collection of shape_id to keep, others are skipped
+    missing = set(SHAPES_TYPES) - set(read_gtfs_header(shapes_path))
+    if missing:
+        raise SystemExit(f"shapes.txt missing columns: {missing}")
+    # stream the file block by block, dropping unwanted shapes per block, so
+    # no full-size intermediate (pandas frame or unfiltered table) is built
+    reader = pacsv.open_csv(
+        shapes_path,
+        read_options=pacsv.ReadOptions(block_size=SHAPES_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=list(SHAPES_TYPES),
+            column_types=SHAPES_TYPES,
+            strings_can_be_null=True,
+        ),
+    )
+    value_set = None
+    if allowed_shape_ids is not None:
+        value_set = pa.array(
+            pd.Series(list(allowed_shape_ids), dtype="string").dropna()
+        )
+    batches = []
+    for batch in reader:
+        if value_set is not None:
+            batch = batch.filter(pc.is_in(batch["shape_id"], value_set=value_set))
+        batches.append(batch)
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    # one dictionary for the whole table so codes are comparable across blocks
+    table = table.unify_dictionaries().combine_chunks()
+    table = table.filter(pc.is_valid(table["shape_id"]))
+    shape_col = table["shape_id"].combine_chunks()
+    dict_codes = shape_col.indices.to_numpy()
+    # dictionary codes follow first appearance; rank them to order shapes by id
+    id_rank = pc.rank(shape_col.dictionary, sort_keys="ascending").to_numpy()
+    order = np.lexsort((table["shape_pt_sequence"].to_numpy(), id_rank[dict_codes]))
+    codes = dict_codes[order]
+    xy = np.column_stack(
+        (
+            table["shape_pt_lon"].to_numpy()[order],
+            table["shape_pt_lat"].to_numpy()[order],
         )
-        if len(coords) < 2:
-            continue
-        lines.append({"shape_id": sid, "geometry": LineString(coords)})
-    gdf = gpd.GeoDataFrame(lines, crs="EPSG:4326")
-    return gdf
+    )
+    # rows are sorted by shape_id, so each shape is a contiguous run of rows
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    counts = np.diff(starts, append=len(codes))
+    # shapes with a single point cannot form a LineString
+    keep = counts >= 2
+    kept_xy = xy[np.repeat(keep, counts)]
+    kept_counts = counts[keep]
+    offsets = np.concatenate(([0], np.cumsum(kept_counts)))
+    return ShapesRagged(
+        shape_ids=pd.Categorical(
+            shape_col.dictionary.to_numpy(zero_copy_only=False)[codes[starts[keep]]]
+        ),
+        offsets=offsets,
+        coords=kept_xy,
+        bounds=per_shape_bounds(kept_xy, offsets),
+    )
 
 
 def optionally_read_routes(routes_path):
     if routes_path is None:
         return None
-    r = pd.read_csv(routes_path, dtype={"route_id": str})
+    r = read_gtfs_csv(routes_path, ROUTES_DTYPES)
     # route_color may or may not exist
     return r
 
@@ -48,33 +266,35 @@ def optionally_read_routes(routes_path):
 def optionally_read_trips(trips_path):
     if trips_path is None:
         return None
-    t = pd.read_csv(
-        trips_path, dtype={"trip_id": str, "route_id": str, "shape_id": str}
-    )
+    t = read_gtfs_csv(trips_path, TRIPS_DTYPES)
     return t
 
 
 def optionally_read_stops(stops_path):
     if stops_path is None:
         return None
-    s = pd.read_csv(stops_path, dtype={"stop_id": str})
+    s = read_gtfs_csv(stops_path, STOPS_DTYPES)
     # require lat/lon
     if not {"stop_lat", "stop_lon"}.issubset(s.columns):
         return None
-    g = gpd.GeoDataFrame(
-        s,
-        geometry=gpd.points_from_xy(s.stop_lon.astype(float), s.stop_lat.astype(float)),
-        crs="EPSG:4326",
-    )
-    return g
+    # plain DataFrame: stops are only drawn, so no Point geometries are built
+    return s
 
 
-def compute_bbox(gdf, padding_fraction=0.02):
+def compute_bbox(shapes, padding_fraction=0.02, bounds=None):
     # returns (minx,miny,maxx,maxy) in lon/lat
-    minx = gdf.total_bounds[0]
-    miny = gdf.total_bounds[1]
-    maxx = gdf.total_bounds[2]
-    maxy = gdf.total_bounds[3]
+    # bounds: optional precomputed (minx,miny,maxx,maxy) to pad
+    if bounds is None:
+        if len(shapes):
+            # reduce the per-shape envelopes rather than every point
+            per_shape = shapes.bounds
+            bounds = (
+                *np.nanmin(per_shape[:, :2], axis=0),
+                *np.nanmax(per_shape[:, 2:], axis=0),
+            )
+        else:
+            bounds = (np.nan,) * 4
+    minx, miny, maxx, maxy = (float(b) for b in bounds)
     dx = maxx - minx
     dy = maxy - miny
     # if degenerate, expand manually
@@ -87,9 +307,45 @@ def compute_bbox(gdf, padding_fraction=0.02):
     return (minx - padx, miny - pady, maxx + padx, maxy + pady)
 
 
+def overlay_size(bbox, scale=1.0):
+    # returns (px_w, px_h) of the overlay, keeping the bbox aspect ratio
+    minx, miny, maxx, maxy = bbox
+    width_deg = maxx - minx
+    height_deg = maxy - miny
+    base_px = int(1200 * scale)
+    aspect = height_deg / width_deg if width_deg != 0 else 1.0
+    return base_px, int(base_px * aspect)
+
+
+def shape_rgba(shapes, route_color_map=None):
+    # (n, 4) float32 RGBA per shape: route colors from shapes.colors where set,
+    # route_color_map (hex or name) elsewhere
+    rgba = np.empty((len(shapes), 4), dtype=np.float32)
+    rgba[:] = to_rgba(route_color_map or "#000000")
+    if shapes.colors is None:
+        return rgba
+    # GTFS route_color is 6 hex digits without the leading '#'; parse all of
+    # them in one bytes.fromhex call instead of per-line matplotlib lookups
+    hexes = pd.Series(shapes.colors, dtype="string").str.lstrip("#")
+    # malformed values fall back to route_color_map
+    known = hexes.str.fullmatch(r"[0-9A-Fa-f]{6}").to_numpy(dtype=bool, na_value=False)
+    rgb = np.frombuffer(bytes.fromhex("".join(hexes[known])), dtype=np.uint8)
+    rgba[known, :3] = rgb.reshape(-1, 3) / 255.0
+    rgba[known, 3] = 1.0
+    return rgba
+
+
+def save_png(rgba, out_png):
+    # fast PNG encode of an (h, w, 4) uint8 buffer: zlib level 1, no optimize pass
+    if imagecodecs is not None:
+        Path(out_png).write_bytes(imagecodecs.png_encode(rgba, level=1))
+    else:
+        Image.fromarray(rgba).save(out_png, optimize=False, compress_level=1)
+
+
 def plot_to_png(
-    shapes_gdf,
-    stops_gdf=None,
+    shapes,
+    stops_df=None,
     out_png="overlay.png",
     dpi=150,
     linewidth=2.0,
@@ -99,36 +355,40 @@ def plot_to_png(
     scale=1.0,
 ):
     if bbox is None:
-        bbox = compute_bbox(shapes_gdf)
+        bbox = compute_bbox(shapes)
     minx, miny, maxx, maxy = bbox
 
-    width_deg = maxx - minx
-    height_deg = maxy - miny
-    base_px = int(1200 * scale)
-    aspect = height_deg / width_deg if width_deg != 0 else 1.0
-    px_w = base_px
-    px_h = int(base_px * aspect)
-
+    px_w, px_h = overlay_size(bbox, scale)
     fig_w = px_w / dpi
     fig_h = px_h / dpi
 
     fig, ax = plt.subplots(figsize=(fig_w, fig_h), dpi=dpi)
+    # axes fill the whole figure so the image edges are exactly the bbox
+    ax.set_position([0, 0, 1, 1])
     ax.set_axis_off()
     ax.set_xlim(minx, maxx)
     ax.set_ylim(miny, maxy)
-    # draw shapes
-    # optionally allow per-shape color via shapes_gdf['color'] if present
-    if "color" in shapes_gdf.columns:
-        for _, row in shapes_gdf.iterrows():
-            c = row["color"] if pd.notna(row["color"]) else "#000000"
-            g = gpd.GeoSeries([row.geometry], crs=shapes_gdf.crs)
-            g.plot(ax=ax, linewidth=linewidth, zorder=2, antialiased=True)
-    else:
-        shapes_gdf.plot(ax=ax, linewidth=linewidth, zorder=2, antialiased=True)
+    # draw shapes as a single LineCollection
+    # optionally allow per-shape color via shapes.colors if set
+    colors = shape_rgba(shapes, route_color_map)
+    ax.add_collection(
+        LineCollection(
+            shapes.segments,
+            colors=colors,
+            linewidths=linewidth,
+            antialiased=True,
+            zorder=2,
+        )
+    )
 
     # draw stops if available
-    if stops_gdf is not None:
-        stops_gdf.plot(ax=ax, markersize=6, zorder=3)
+    if stops_df is not None:
+        ax.scatter(
+            stops_df["stop_lon"].to_numpy(),
+            stops_df["stop_lat"].to_numpy(),
+            s=6,
+            zorder=3,
+        )
 
     # set transparent background
     if background_color:
@@ -136,74 +396,147 @@ def plot_to_png(
     else:
         fig.patch.set_alpha(0.0)
     ax.patch.set_alpha(0.0)
-
-    # save
-    fig.savefig(out_png, bbox_inches="tight", pad_inches=0, transparent=True)
+    # save: rasterize once with Agg and encode the RGBA buffer directly
+    fig.canvas.draw()
+    save_png(np.asarray(fig.canvas.buffer_rgba()), out_png)
     plt.close(fig)
     return bbox
 
 
-def enrich_colors_from_routes(shapes_gdf, trips_df, routes_df):
+def plot_to_png_datashader(
+    shapes,
+    stops_df=None,
+    out_png="overlay.png",
+    dpi=150,
+    linewidth=2.0,
+    route_color_map=None,
+    bbox=None,
+    scale=1.0,
+):
+    """
+    Same overlay as plot_to_png, rasterized with datashader (optional dependency).
+    Faster than matplotlib for feeds with tens of thousands of shapes.
+    """
+    try:
+        import datashader as ds
+        import datashader.transfer_functions as tf
+    except ImportError:
+        raise SystemExit("Error: --engine datashader requires the datashader package")
+
+    if bbox is None:
+        bbox = compute_bbox(shapes)
+    minx, miny, maxx, maxy = bbox
+    px_w, px_h = overlay_size(bbox, scale)
+    cvs = ds.Canvas(
+        plot_width=px_w, plot_height=px_h, x_range=(minx, maxx), y_range=(miny, maxy)
+    )
+
+    # one coordinate table for all shapes, NaN rows separate the lines
+    offsets = shapes.offsets
+    # datashader keys colors by category: one category per distinct RGBA
+    palette, color_codes = np.unique(
+        shape_rgba(shapes, route_color_map), axis=0, return_inverse=True
+    )
+    color_codes = color_codes.ravel()
+    breaks = offsets[1:-1]
+    coords = np.insert(shapes.coords, breaks, np.nan, axis=0)
+    line_colors = np.insert(
+        np.repeat(color_codes, np.diff(offsets)), breaks, color_codes[1:]
+    )
+    lines_df = pd.DataFrame(
+        {
+            "x": coords[:, 0],
+            "y": coords[:, 1],
+            "color": pd.Categorical(line_colors),
+        }
+    )
+    # matplotlib linewidth is in points, datashader line_width in pixels
+    agg = cvs.line(
+        lines_df,
+        "x",
+        "y",
+        agg=ds.count_cat("color"),
+        line_width=linewidth * dpi / 72,
+    )
+    color_key = {c: to_hex(palette[c]) for c in lines_df["color"].cat.categories}
+    img = tf.shade(agg, color_key=color_key, min_alpha=255)
+
+    # draw stops if available
+    if stops_df is not None:
+        stops_agg = cvs.points(stops_df, "stop_lon", "stop_lat")
+        img = tf.stack(img, tf.spread(tf.shade(stops_agg, cmap=["#1f77b4"]), px=1))
+
+    save_png(np.asarray(img.to_pil()), out_png)
+    return bbox
+
+
+def enrich_colors_from_routes(shapes, trips_df, routes_df):
     # join trips->routes->route_color for shapes where shape_id appears in trips
     if trips_df is None or routes_df is None:
-        return shapes_gdf
+        return shapes
     # ensure columns exist
     if "shape_id" not in trips_df.columns or "route_id" not in trips_df.columns:
-        return shapes_gdf
+        return shapes
     if "route_id" not in routes_df.columns:
-        return shapes_gdf
-    # merge
-    trip_route = trips_df[["shape_id", "route_id"]].drop_duplicates()
-    route_color = (
-        routes_df[["route_id", "route_color"]].drop_duplicates()
-        if "route_color" in routes_df.columns
-        else None
+        return shapes
+    if "route_color" not in routes_df.columns:
+        return shapes
+    # merge trips->routes->route_color, one color per shape
+    color_df = (
+        trips_df[["shape_id", "route_id"]]
+        .drop_duplicates()
+        .merge(
+            routes_df[["route_id", "route_color"]].drop_duplicates(),
+            on="route_id",
+            how="left",
+        )
+        .dropna(subset=["route_color"])
+        .drop_duplicates("shape_id", keep="last")
+        .rename(columns={"route_color": "color"})
     )
-    if route_color is None:
-        return shapes_gdf
-    merged = trip_route.merge(route_color, on="route_id", how="left")
-    # map shape_id -> color
-    color_map = dict(merged[["shape_id", "route_color"]].dropna().values)
-    shapes_gdf = shapes_gdf.copy()
-    shapes_gdf["color"] = shapes_gdf["shape_id"].map(color_map)
-    return shapes_gdf
+    colors = (
+        pd.DataFrame({"shape_id": shapes.shape_ids})
+        .merge(color_df[["shape_id", "color"]], on="shape_id", how="left")["color"]
+        .to_numpy()
+    )
+    return dataclasses.replace(shapes, colors=colors)
 
 
-def filter_shapes_by_route(shapes_gdf, trips_df, route_ids):
+def filter_shapes_by_route(shapes, trips_df, route_ids):
     """
     Filter shapes to export based on the desired route_id list.
     """
     if trips_df is None or route_ids is None:
-        return shapes_gdf
+        return shapes
+    # shape_id associated with these route_id
+    shape_ids = shape_ids_for_routes(trips_df, route_ids)
+    return shapes.take(shapes.shape_ids.isin(shape_ids))
+
+
+def shape_ids_for_routes(trips_df, route_ids, direction=None):
+    """
+    Unique shape_ids used by trips of the given routes and optional direction.
+    """
     if isinstance(route_ids, str):
         route_ids = [route_ids]
-    # list of shape_id associated with these route_id
-    shape_ids = (
-        trips_df.loc[trips_df["route_id"].isin(route_ids), "shape_id"].unique().tolist()
-    )
-    filtered = shapes_gdf[shapes_gdf["shape_id"].isin(shape_ids)]
-    return filtered
+    # one boolean mask over the trips, no intermediate filtered frames
+    mask = trips_df["route_id"].isin(route_ids).to_numpy()
+    if direction is not None and "direction_id" in trips_df.columns:
+        mask &= (trips_df["direction_id"] == direction).to_numpy(
+            dtype=bool, na_value=False
+        )
+    # unique over the categorical codes of the kept trips
+    return trips_df["shape_id"].array[mask].unique()
 
 
-def filter_shapes_by_route_and_direction(
-    shapes_gdf, trips_df, route_ids, direction=None
-):
+def filter_shapes_by_route_and_direction(shapes, trips_df, route_ids, direction=None):
     """
     Filter shapes to export based on route_id list and optional direction.
     """
     if trips_df is None or route_ids is None:
-        return shapes_gdf
-    if isinstance(route_ids, str):
-        route_ids = [route_ids]
-    # Filter trips by route_id
-    trips_filtered = trips_df[trips_df["route_id"].isin(route_ids)]
-    # Filter by direction if specified
-    if direction is not None and "direction_id" in trips_filtered.columns:
-        trips_filtered = trips_filtered[trips_filtered["direction_id"] == direction]
-    # List of shape_ids to keep
-    shape_ids = trips_filtered["shape_id"].unique().tolist()
-    filtered = shapes_gdf[shapes_gdf["shape_id"].isin(shape_ids)]
-    return filtered
+        return shapes
+    shape_ids = shape_ids_for_routes(trips_df, route_ids, direction=direction)
+    return shapes.take(shapes.shape_ids.isin(shape_ids))
 
 
 def main():
@@ -229,24 +562,20 @@ def main():
     p.add_argument(
         "--color", default="#ff0000", help="Line color in hex or name (default red)"
     )
+    p.add_argument(
+        "--engine",
+        choices=["matplotlib", "datashader"],
+        default="matplotlib",
+        help="Rasterizer (datashader is faster on very large feeds)",
+    )
     p.add_argument("--route_id", help="Filter a single route (e.g.: 42)")
     p.add_argument(
         "--route_ids", help="Multiple routes separated by commas (e.g.: 42,44,46)"
     )
     args = p.parse_args()
-
-    shapes_gdf = read_shapes(args.shapes)
-    trips_df = (
-        None
-        if args.trips is None
-        else pd.read_csv(args.trips, dtype={"shape_id": str, "route_id": str})
-    )
-    routes_df = (
-        None
-        if args.routes is None
-        else pd.read_csv(args.routes, dtype={"route_id": str})
-    )
-    stops_gdf = optionally_read_stops(args.stops)
+    trips_df = optionally_read_trips(args.trips)
+    routes_df = optionally_read_routes(args.routes)
+    stops_df = optionally_read_stops(args.stops)
 
     # Filter by route_id
     route_filter = None
@@ -257,21 +586,25 @@ def main():
     if route_filter:
         if trips_df is None:
             raise SystemExit("Error: --trips required to filter by route_id")
-        shapes_gdf = filter_shapes_by_route_and_direction(
-            shapes_gdf, trips_df, route_filter, direction=args.direction
-        )
-        print(
-            f"Filter applied: {len(shapes_gdf)} shapes matching route_id={route_filter}"
+        # resolve the shapes first so shapes.txt rows of other routes are dropped
+        # before any geometry is built
+        allowed_shape_ids = shape_ids_for_routes(
+            trips_df, route_filter, direction=args.direction
         )
+        shapes = read_shapes(args.shapes, allowed_shape_ids=allowed_shape_ids)
+        print(f"Filter applied: {len(shapes)} shapes matching route_id={route_filter}")
+    else:
+        shapes = read_shapes(args.shapes)
 
     # Coloring
     if routes_df is not None and trips_df is not None:
-        shapes_gdf = enrich_colors_from_routes(shapes_gdf, trips_df, routes_df)
+        shapes = enrich_colors_from_routes(shapes, trips_df, routes_df)
 
-    bbox = compute_bbox(shapes_gdf, padding_fraction=args.pad)
-    bbox_used = plot_to_png(
-        shapes_gdf,
-        stops_gdf,
+    bbox = compute_bbox(shapes, padding_fraction=args.pad)
+    render = plot_to_png_datashader if args.engine == "datashader" else plot_to_png
+    bbox_used = render(
+        shapes,
+        stops_df,
         out_png=args.out,
         dpi=args.dpi,
         linewidth=args.linewidth,
@@ -284,7 +617,6 @@ def main():
     leaflet_bounds = [[bbox_used[1], bbox_used[0]], [bbox_used[3], bbox_used[2]]]
     center_lat = (bbox_used[1] + bbox_used[3]) / 2
     center_lon = (bbox_used[0] + bbox_used[2]) / 2
-
     metadata = {
         "bounds": {
             "min_lon": bbox_used[0],
@@ -300,7 +632,6 @@ def main():
 
     with open("overlay-metadata.json", "w") as f:
         json.dump(metadata, f, indent=2)
-
     # Display the ready-to-copy Leaflet line
     print("\n✅ Image generated:", args.out)
     print("📍 Leaflet coordinates:")
@@ -0,0 +1,107 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import gtfs_to_png  # noqa: E402
+
+
+def write_feed(tmp_path, route_ids, shape_ids, route_colors=None):
+    # one two-point shape per route, one trip per route
+    shapes = ["shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence"]
+    for i, sid in enumerate(shape_ids):
+        shapes.append(f"{sid},49.{i}0,-123.{i}0,1")
+        shapes.append(f"{sid},49.{i}5,-123.{i}5,2")
+    trips = ["route_id,service_id,trip_id,direction_id,shape_id"]
+    for i, (rid, sid) in enumerate(zip(route_ids, shape_ids)):
+        trips.append(f"{rid},WK,T{i},0,{sid}")
+    routes = ["route_id,route_color"]
+    for i, rid in enumerate(route_ids):
+        color = route_colors[i] if route_colors else "57161F"
+        routes.append(f"{rid},{color}")
+    paths = {}
+    for name, lines in [("shapes", shapes), ("trips", trips), ("routes", routes)]:
+        paths[name] = tmp_path / f"{name}.txt"
+        paths[name].write_text("\n".join(lines) + "\n")
+    return paths
+
+
+def test_string_ids_keep_leading_zeros(tmp_path):
+    paths = write_feed(tmp_path, ["007", "7"], ["0042", "42"])
+    routes = gtfs_to_png.optionally_read_routes(paths["routes"])
+    assert list(routes["route_id"]) == ["007", "7"]
+    assert list(routes["route_color"]) == ["57161F", "57161F"]
+
+
+def test_blank_strings_read_as_missing(tmp_path):
+    # both routes share shape 0042; route 7 has a blank route_color
+    paths = write_feed(tmp_path, ["007", "7"], ["0042", "0042"], ["00FF00", ""])
+    with open(paths["trips"], "a") as f:
+        f.write("7,WK,T2,0,\n")
+    with open(paths["shapes"], "a") as f:
+        f.write(",49.9,-123.9,1\n,49.8,-123.8,2\n")
+    trips = gtfs_to_png.optionally_read_trips(paths["trips"])
+    routes = gtfs_to_png.optionally_read_routes(paths["routes"])
+    assert routes["route_color"].isna().tolist() == [False, True]
+    assert trips["shape_id"].isna().tolist() == [False, False, True]
+    assert "" not in trips["shape_id"].cat.categories
+    shapes = gtfs_to_png.read_shapes(paths["shapes"])
+    assert list(shapes.shape_ids) == ["0042"]
+    colored = gtfs_to_png.enrich_colors_from_routes(shapes, trips, routes)
+    assert list(colored.colors) == ["00FF00"]
+
+
+def test_numeric_ids_filter_and_color(tmp_path):
+    paths = write_feed(tmp_path, ["7", "42", "44"], ["1", "2", "3"])
+    trips = gtfs_to_png.optionally_read_trips(paths["trips"])
+    routes = gtfs_to_png.optionally_read_routes(paths["routes"])
+    assert list(trips["route_id"].cat.categories) == ["42", "44", "7"]
+    shapes = gtfs_to_png.read_shapes(paths["shapes"])
+    filtered = gtfs_to_png.filter_shapes_by_route_and_direction(
+        shapes, trips, ["42"], direction=0
+    )
+    assert list(filtered.shape_ids) == ["2"]
+    colored = gtfs_to_png.enrich_colors_from_routes(shapes, trips, routes)
+    assert list(colored.colors) == ["57161F"] * 3
+
+
+def test_malformed_route_color_uses_default(tmp_path):
+    paths = write_feed(tmp_path, ["1", "2"], ["1", "2"], ["GGGGGG", "00ff00"])
+    shapes = gtfs_to_png.enrich_colors_from_routes(
+        gtfs_to_png.read_shapes(paths["shapes"]),
+        gtfs_to_png.optionally_read_trips(paths["trips"]),
+        gtfs_to_png.optionally_read_routes(paths["routes"]),
+    )
+    rgba = gtfs_to_png.shape_rgba(shapes, "#ff0000")
+    assert rgba.tolist() == [[1, 0, 0, 1], [0, 1, 0, 1]]
+
+
+def test_per_shape_bounds_numba_matches_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    nan = np.nan
+    coords = np.array(
+        [
+            [-123.1, 49.1],
+            [-123.2, nan],
+            [-123.3, 49.3],
+            [nan, 49.5],
+            [-123.4, 49.6],
+            [nan, nan],
+            [nan, nan],
+        ],
+        dtype=np.float32,
+    )
+    offsets = np.array([0, 3, 5, 7])
+    kernel_bounds = gtfs_to_png.per_shape_bounds(coords, offsets)
+    monkeypatch.setattr(gtfs_to_png, "numba", None)
+    numpy_bounds = gtfs_to_png.per_shape_bounds(coords, offsets)
+    np.testing.assert_array_equal(kernel_bounds, numpy_bounds)
+    np.testing.assert_allclose(
+        numpy_bounds[:2],
+        [[-123.3, 49.1, -123.1, 49.3], [-123.4, 49.5, -123.4, 49.6]],
+        rtol=1e-6,
+    )
+    assert np.isnan(numpy_bounds[2]).all()